@@ -0,0 +1,27 @@
+-- Reset function for Tidal RAG System
+-- Clears the knowledge base in a single statement, used by reset-and-reingest.ts
+-- TRUNCATE frees the table storage immediately, so no VACUUM is needed afterwards
+
+DROP FUNCTION IF EXISTS reset_knowledge_base();
+
+CREATE OR REPLACE FUNCTION reset_knowledge_base()
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  -- prds goes too: TRUNCATE chunks removes PRD chunks, and a prds row
+  -- without chunks would otherwise be left behind
+  TRUNCATE chunk_embeddings, chunks, designs, prds;
+END;
+$$;
+
+-- TRUNCATE bypasses RLS, so only the service role may call this.
+-- Without the REVOKE, PostgREST would expose it to anyone with the anon key.
+REVOKE EXECUTE ON FUNCTION reset_knowledge_base() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION reset_knowledge_base() TO service_role;
+
+-- Summary:
+-- ✅ Embeddings, chunks, designs and PRDs are cleared in one round trip
+-- ✅ Runs in one transaction - a failure leaves the data untouched
+-- ✅ Callable only with the service role key
+-- Run from code: supabase.rpc('reset_knowledge_base')
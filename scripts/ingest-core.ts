@@ -0,0 +1,246 @@
+/**
+ * Shared ingestion helpers for Tidal RAG
+ *
+ * Hashing, chunking, embedding and storage walking used by ingest.ts,
+ * ingest-worker.ts, ingest-with-bull.ts and reingest-prd.ts, so an
+ * optimization made here applies to every ingestion path.
+ */
+
+import type { SupabaseClient } from '@supabase/supabase-js';
+import type OpenAI from 'openai';
+import * as crypto from 'crypto';
+import * as path from 'path';
+import { fileURLToPath } from 'url';
+
+export const STORAGE_BUCKET = 'tidal-docs';
+export const EMBEDDING_MODEL = 'text-embedding-3-small'; // 1536 dims
+
+// Machine-local record of what ingest.ts last saw in storage (git-ignored)
+export const TRACKING_FILE = path.join(
+  path.dirname(fileURLToPath(import.meta.url)),
+  '../rag_system/.ingest_tracker.json'
+);
+
+// Image extensions to look for
+export const IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp'];
+
+// Lone surrogates (common in PDF extraction), null bytes and control chars other
+// than \t, \n, \r - none of which PostgreSQL text columns accept. One class so
+// sanitizing is a single pass over the content.
+export const INVALID_TEXT_CHARS = /[\uD800-\uDFFF\x00-\x08\x0B\x0C\x0E-\x1F\x7F]/g;
+
+/**
+ * A file found while walking storage, with the listing metadata used for
+ * change detection when the listing provides it
+ */
+export interface StorageFile {
+  path: string;
+  eTag?: string;
+  size?: number;
+}
+
+/**
+ * Compute SHA256 hash of text content
+ */
+export function sha256(content: string): string {
+  return crypto.createHash('sha256').update(content, 'utf-8').digest('hex');
+}
+
+/**
+ * Simple text chunker with overlap
+ */
+export function chunkText(text: string, chunkSize: number, chunkOverlap: number): string[] {
+  const chunks: string[] = [];
+  let start = 0;
+
+  while (start < text.length) {
+    const end = Math.min(start + chunkSize, text.length);
+    chunks.push(text.slice(start, end));
+    start += chunkSize - chunkOverlap;
+  }
+
+  return chunks.length > 0 ? chunks : [text];
+}
+
+/**
+ * pgvector stores float4, so digits beyond float32 precision are dropped on
+ * insert anyway. Rounding to 9 significant digits keeps the stored value
+ * bit-identical while cutting the JSON body of embedding inserts by ~35%.
+ */
+export function compactEmbedding(embedding: number[]): number[] {
+  return embedding.map(value => Number(Math.fround(value).toPrecision(9)));
+}
+
+/**
+ * Create embeddings in batches, pausing `delayMs` between batches for rate limits
+ */
+export async function createEmbeddings(
+  openai: OpenAI,
+  texts: string[],
+  batchSize: number,
+  delayMs: number
+): Promise<number[][]> {
+  const embeddings: number[][] = [];
+
+  for (let i = 0; i < texts.length; i += batchSize) {
+    const batch = texts.slice(i, i + batchSize);
+    const response = await openai.embeddings.create({
+      model: EMBEDDING_MODEL,
+      input: batch,
+    });
+    embeddings.push(...response.data.map(e => e.embedding));
+
+    if (i + batchSize < texts.length) {
+      await new Promise(resolve => setTimeout(resolve, delayMs));
+    }
+  }
+
+  return embeddings;
+}
+
+/**
+ * Run `worker` over `items` with at most `limit` calls in flight, preserving order
+ */
+export async function mapWithConcurrency<T, R>(
+  items: T[],
+  limit: number,
+  worker: (item: T) => Promise<R>
+): Promise<R[]> {
+  const results: R[] = new Array(items.length);
+  let next = 0;
+
+  const runners = Array.from({ length: Math.min(limit, items.length) }, async () => {
+    while (next < items.length) {
+      const index = next++;
+      results[index] = await worker(items[index]);
+    }
+  });
+
+  await Promise.all(runners);
+  return results;
+}
+
+/**
+ * Recursively walk Supabase Storage, yielding files as each listing page
+ * arrives instead of collecting the whole tree first. Pages through folders
+ * with more than one listing page of entries.
+ */
+export async function* walkStorage(
+  supabase: SupabaseClient,
+  folderPath: string = ''
+): AsyncGenerator<StorageFile> {
+  console.log(`  🔍 Scanning: ${folderPath || 'root'}`);
+  const pageSize = 1000;
+
+  for (let offset = 0; ; offset += pageSize) {
+    const { data, error } = await supabase.storage
+      .from(STORAGE_BUCKET)
+      .list(folderPath, {
+        limit: pageSize,
+        offset,
+        sortBy: { column: 'name', order: 'asc' }
+      });
+
+    if (error) {
+      console.error(`  ❌ Error listing ${folderPath}:`, error);
+      return;
+    }
+
+    if (!data || data.length === 0) {
+      if (offset === 0) console.log(`  📭 Empty: ${folderPath}`);
+      return;
+    }
+
+    for (const item of data) {
+      const itemPath = folderPath ? `${folderPath}/${item.name}` : item.name;
+      const file: StorageFile = {
+        path: itemPath,
+        eTag: item.metadata?.eTag,
+        size: item.metadata?.size,
+      };
+
+      // Check if it's a file or folder
+      // In Supabase Storage: folders have id === null, files have an id
+      // However, we also check for file extensions to be sure
+      const hasFileExtension = item.name.match(/\.(txt|md|json|pdf|ts|js|py|go|java|cpp|c|h|rb|php|rs|sh)$/i);
+
+      if (hasFileExtension) {
+        // Definitely a file (has extension)
+        yield file;
+      } else if (item.id === null) {
+        // No ID = folder in Supabase Storage
+        yield* walkStorage(supabase, itemPath);
+      } else {
+        // Has ID but no extension - could be a file without extension or edge case
+        // Try recursing first (safer - if it's a folder, we'll find files inside)
+        // If it yields nothing, it's likely a file without extension
+        let foundInside = false;
+        for await (const subFile of walkStorage(supabase, itemPath)) {
+          foundInside = true;
+          yield subFile;
+        }
+        if (!foundInside) {
+          console.log(`  📄 Treating as file: ${item.name}`);
+          yield file;
+        }
+      }
+    }
+
+    if (data.length < pageSize) return;
+  }
+}
+
+/**
+ * Find ANY image file in the same folder as the JSON/text file
+ * This is more flexible and works with any naming convention
+ */
+export async function findMatchingImage(supabase: SupabaseClient, filePath: string): Promise<string | null> {
+  const dir = path.dirname(filePath);
+
+  try {
+    // List all files in the same folder
+    const { data: files, error } = await supabase.storage
+      .from(STORAGE_BUCKET)
+      .list(dir, {
+        limit: 100,
+        sortBy: { column: 'name', order: 'asc' }
+      });
+
+    if (error || !files) {
+      return null;
+    }
+
+    // Find the first image file in the folder
+    for (const file of files) {
+      const isImage = IMAGE_EXTENSIONS.some(ext =>
+        file.name.toLowerCase().endsWith(ext)
+      );
+
+      if (isImage && file.metadata) {
+        return `${dir}/${file.name}`;
+      }
+    }
+
+    return null;
+  } catch (err) {
+    return null;
+  }
+}
+
+/**
+ * Get public URL for an image in storage
+ * Properly encodes the path to handle special characters like colons
+ */
+export function getImagePublicUrl(supabase: SupabaseClient, imagePath: string): string {
+  const { data } = supabase.storage
+    .from(STORAGE_BUCKET)
+    .getPublicUrl(imagePath);
+
+  // The URL might contain unencoded colons and other special chars
+  // Split by slashes, encode each part, then rejoin
+  const url = new URL(data.publicUrl);
+  const pathParts = url.pathname.split('/').map(part => encodeURIComponent(decodeURIComponent(part)));
+  url.pathname = pathParts.join('/');
+
+  return url.toString();
+}
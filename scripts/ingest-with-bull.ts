@@ -12,6 +12,7 @@ import { fileURLToPath } from 'url';
 import dotenv from 'dotenv';
 import { waitForSupabaseWakeup } from './retry-utils.js';
 import { createIngestionQueue } from './queue-config.js';
+import { walkStorage } from './ingest-core.js';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -28,69 +29,6 @@ if (!SUPABASE_URL || !SUPABASE_KEY) {
 }
 
 const supabase = createClient(SUPABASE_URL, SUPABASE_KEY);
-const STORAGE_BUCKET = 'tidal-docs';
-
-/**
- * Recursively list all files in Supabase Storage
- */
-async function listStorageFilesRecursive(folderPath: string = ''): Promise<string[]> {
-  console.log(`  🔍 Scanning: ${folderPath || 'root'}`);
-
-  const { data, error } = await supabase.storage
-    .from(STORAGE_BUCKET)
-    .list(folderPath, {
-      limit: 1000,
-      sortBy: { column: 'name', order: 'asc' }
-    });
-
-  if (error) {
-    console.error(`  ❌ Error listing ${folderPath}:`, error);
-    return [];
-  }
-
-  if (!data || data.length === 0) {
-    console.log(`  📭 Empty: ${folderPath}`);
-    return [];
-  }
-
-  const files: string[] = [];
-
-  for (const item of data) {
-    const itemPath = folderPath ? `${folderPath}/${item.name}` : item.name;
-
-    // Check if it's a file or folder
-    // In Supabase Storage: folders have id === null, files have an id
-    // However, we also check for file extensions to be sure
-    const hasFileExtension = item.name.match(/\.(txt|md|json|pdf|ts|js|py|go|java|cpp|c|h|rb|php|rs|sh)$/i);
-    
-    if (hasFileExtension) {
-      // Definitely a file (has extension)
-      console.log(`  📄 File: ${item.name}`);
-      files.push(itemPath);
-    } else if (item.id === null) {
-      // No ID = folder in Supabase Storage
-      console.log(`  📁 Folder: ${item.name}`);
-      const subFiles = await listStorageFilesRecursive(itemPath);
-      files.push(...subFiles);
-    } else {
-      // Has ID but no extension - could be a file without extension or edge case
-      // Try recursing first (safer - if it's a folder, we'll find files inside)
-      // If it fails or returns nothing, it's likely a file without extension
-      console.log(`  ❓ Checking: ${item.name} (has ID but no extension)`);
-      const subFiles = await listStorageFilesRecursive(itemPath);
-      if (subFiles.length > 0) {
-        // It was a folder, got files
-        files.push(...subFiles);
-      } else {
-        // No files found inside, treat as file anyway (might be file without extension)
-        console.log(`  📄 Treating as file: ${item.name}`);
-        files.push(itemPath);
-      }
-    }
-  }
-
-  return files;
-}
 
 async function main() {
   console.log('\n' + '='.repeat(60));
@@ -122,7 +60,10 @@ async function main() {
   const allFiles: { path: string; type: 'prd' | 'design' | 'code' }[] = [];
 
   for (const scanPath of paths) {
-    const files = await listStorageFilesRecursive(scanPath);
+    const files: string[] = [];
+    for await (const file of walkStorage(supabase, scanPath)) {
+      files.push(file.path);
+    }
     
     // Determine file type based on the full file path (not just scanPath)
     // This handles nested folders correctly
@@ -8,12 +8,21 @@
 
 import { createClient } from '@supabase/supabase-js';
 import OpenAI from 'openai';
-import * as crypto from 'crypto';
 import * as path from 'path';
 import { fileURLToPath } from 'url';
 import dotenv from 'dotenv';
 import { retryWithBackoff } from './retry-utils.js';
 import { createIngestionQueue } from './queue-config.js';
+import {
+  STORAGE_BUCKET,
+  INVALID_TEXT_CHARS,
+  sha256,
+  chunkText,
+  compactEmbedding,
+  createEmbeddings,
+  findMatchingImage,
+  getImagePublicUrl,
+} from './ingest-core.js';
 import type { Job } from 'bull';
 
 const __filename = fileURLToPath(import.meta.url);
@@ -31,20 +40,18 @@ if (!SUPABASE_URL || !SUPABASE_KEY || !OPENAI_KEY) {
   process.exit(1);
 }
 
-const supabase = createClient(SUPABASE_URL, SUPABASE_KEY);
+// One long-lived client for the whole run. Node's fetch already pools keep-alive
+// connections per origin; with a service-role key there is no user session to
+// persist or refresh, so skip the auth bookkeeping on every request.
+const supabase = createClient(SUPABASE_URL, SUPABASE_KEY, {
+  auth: { persistSession: false, autoRefreshToken: false },
+});
 const openai = new OpenAI({ apiKey: OPENAI_KEY });
 
 // Config
-const STORAGE_BUCKET = 'tidal-docs';
 const CHUNK_SIZE = 1500;           // Increased from 1000 to create fewer chunks
 const CHUNK_OVERLAP = 300;         // Increased overlap
-const EMBEDDING_MODEL = 'text-embedding-3-small';
 const BATCH_SIZE = 25;             // Reduced from 100 to reduce database load
-const IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp'];
-
-function sha256(content: string): string {
-  return crypto.createHash('sha256').update(content, 'utf-8').digest('hex');
-}
 
 /**
  * Sanitize content by removing null bytes, invalid Unicode surrogates, and other problematic characters
@@ -53,40 +60,8 @@ function sha256(content: string): string {
 function sanitizeContent(content: string): string {
   if (!content) return '';
   
-  // First, handle invalid Unicode surrogates (common in PDFs)
-  // Remove lone surrogates (high surrogates without low, or low without high)
-  let sanitized = content.replace(/[\uD800-\uDFFF]/g, '');
-  
-  // Remove null bytes and other control characters (except common whitespace)
-  sanitized = sanitized
-    .replace(/\0/g, '')  // Remove null bytes
-    .replace(/\x00/g, '')  // Remove any additional null bytes
-    .replace(/[\x01-\x08\x0B-\x0C\x0E-\x1F\x7F]/g, '');  // Remove other control chars except \t, \n, \r
-  
-  // Ensure valid UTF-8 encoding
-  try {
-    // Re-encode to ensure valid UTF-8
-    const buffer = Buffer.from(sanitized, 'utf-8');
-    sanitized = buffer.toString('utf-8');
-  } catch (e) {
-    // If encoding fails, try to recover by removing invalid sequences
-    sanitized = sanitized.replace(/[^\x00-\x7F]/g, '');  // Fallback: ASCII only
-  }
-  
-  return sanitized.trim();
-}
-
-function chunkText(text: string): string[] {
-  const chunks: string[] = [];
-  let start = 0;
-
-  while (start < text.length) {
-    const end = Math.min(start + CHUNK_SIZE, text.length);
-    chunks.push(text.slice(start, end));
-    start += CHUNK_SIZE - CHUNK_OVERLAP;
-  }
-
-  return chunks.length > 0 ? chunks : [text];
+  // With surrogates gone the string is always valid UTF-8, so no re-encode is needed
+  return content.replace(INVALID_TEXT_CHARS, '').trim();
 }
 
 async function isAlreadyIngested(storagePath: string, hash: string, type: 'prd' | 'design' | 'code'): Promise<boolean> {
@@ -196,13 +171,8 @@ async function downloadFile(filePath: string): Promise<string> {
             throw new Error('PDF is image-based (scanned) and has no extractable text. OCR is not currently configured. To enable OCR, install system dependencies and npm packages.');
           }
           
-          // Remove invalid Unicode surrogates (common issue with PDF extraction)
-          pdfText = pdfText.replace(/[\uD800-\uDFFF]/g, '');
-          
-          // Remove other problematic characters
-          pdfText = pdfText
-            .replace(/\0/g, '')  // Null bytes
-            .replace(/[\x01-\x08\x0B-\x0C\x0E-\x1F\x7F]/g, '');  // Control chars
+          // Remove invalid Unicode surrogates, null bytes and control chars
+          pdfText = pdfText.replace(INVALID_TEXT_CHARS, '');
           
           // Normalize whitespace (PDFs often have weird spacing) - but preserve newlines for paragraphs
           pdfText = pdfText.replace(/[ \t]+/g, ' ');  // Only normalize spaces/tabs, keep newlines
@@ -232,68 +202,6 @@ async function downloadFile(filePath: string): Promise<string> {
   );
 }
 
-async function createEmbeddings(texts: string[]): Promise<number[][]> {
-  const embeddings: number[][] = [];
-
-  for (let i = 0; i < texts.length; i += BATCH_SIZE) {
-    const batch = texts.slice(i, i + BATCH_SIZE);
-    const response = await openai.embeddings.create({
-      model: EMBEDDING_MODEL,
-      input: batch,
-    });
-    embeddings.push(...response.data.map(e => e.embedding));
-
-    if (i + BATCH_SIZE < texts.length) {
-      await new Promise(resolve => setTimeout(resolve, 3000)); // Increased from 1000 to 3000ms for database recovery
-    }
-  }
-
-  return embeddings;
-}
-
-async function findMatchingImage(filePath: string): Promise<string | null> {
-  const dir = path.dirname(filePath);
-
-  try {
-    const { data: files, error } = await supabase.storage
-      .from(STORAGE_BUCKET)
-      .list(dir, {
-        limit: 100,
-        sortBy: { column: 'name', order: 'asc' }
-      });
-
-    if (error || !files) {
-      return null;
-    }
-
-    for (const file of files) {
-      const isImage = IMAGE_EXTENSIONS.some(ext =>
-        file.name.toLowerCase().endsWith(ext)
-      );
-
-      if (isImage && file.metadata) {
-        return `${dir}/${file.name}`;
-      }
-    }
-
-    return null;
-  } catch (err) {
-    return null;
-  }
-}
-
-function getImagePublicUrl(imagePath: string): string {
-  const { data } = supabase.storage
-    .from(STORAGE_BUCKET)
-    .getPublicUrl(imagePath);
-
-  const url = new URL(data.publicUrl);
-  const pathParts = url.pathname.split('/').map(part => encodeURIComponent(decodeURIComponent(part)));
-  url.pathname = pathParts.join('/');
-
-  return url.toString();
-}
-
 async function ingestFile(
   storagePath: string,
   type: 'prd' | 'design' | 'code'
@@ -309,7 +217,7 @@ async function ingestFile(
 
     console.log(`   📏 Content after sanitization: ${content?.length || 0} characters`);
 
-    if (!content || content.trim().length === 0) {
+    if (!content || !/\S/.test(content)) {
       console.error(`   ❌ Content is empty after sanitization for: ${storagePath}`);
       return { status: 'failed', chunks: 0 };
     }
@@ -398,12 +306,13 @@ async function ingestFile(
       return { status: 'skipped', chunks: 0 };
     }
 
-    const imagePath = await findMatchingImage(storagePath);
-    const imageUrl = imagePath ? getImagePublicUrl(imagePath) : null;
+    const imagePath = await findMatchingImage(supabase, storagePath);
+    const imageUrl = imagePath ? getImagePublicUrl(supabase, imagePath) : null;
 
     // Extract figma_url from JSON design files (from identifiers.figmaUrl)
+    // Full design exports can be megabytes; only parse them when the key is present
     let figmaUrl: string | null = null;
-    if (type === 'design' && fileName.endsWith('.json')) {
+    if (type === 'design' && fileName.endsWith('.json') && content.includes('"figmaUrl"')) {
       try {
         const jsonData = JSON.parse(content);
         figmaUrl = jsonData.identifiers?.figmaUrl || jsonData.figmaUrl || null;
@@ -417,7 +326,7 @@ async function ingestFile(
     }
 
     console.log(`   ✂️  Chunking content...`);
-    const chunks = chunkText(content);
+    const chunks = chunkText(content, CHUNK_SIZE, CHUNK_OVERLAP);
     console.log(`   📦 Created ${chunks.length} chunks (avg ${Math.round(content.length / chunks.length)} chars per chunk)`);
 
     if (chunks.length === 0) {
@@ -426,7 +335,7 @@ async function ingestFile(
     }
 
     console.log(`   🧮 Creating embeddings...`);
-    const embeddings = await createEmbeddings(chunks);
+    const embeddings = await createEmbeddings(openai, chunks, BATCH_SIZE, 3000); // 3s between batches for database recovery
     console.log(`   ✅ Created ${embeddings.length} embeddings`);
 
     let docId: string;
@@ -534,7 +443,7 @@ async function ingestFile(
 
     const embeddingRows = chunkData.map((chunk, i) => ({
       chunk_id: chunk.id,
-      embedding: embeddings[i],
+      embedding: compactEmbedding(embeddings[i]),
     }));
 
     const { error: embError } = await supabase
@@ -3,16 +3,32 @@
  * Ingestion Script for Tidal RAG
  * 
  * Reads files from Supabase Storage bucket, chunks them, creates embeddings,
- * and stores in Postgres. Skips unchanged files using SHA256 hashing.
+ * and stores in Postgres. Skips unchanged files using SHA256 hashing; files
+ * whose storage eTag and size match the local tracking file are skipped
+ * without being downloaded (pass --verify-hash to always re-hash).
  */
 
 import { createClient } from '@supabase/supabase-js';
 import OpenAI from 'openai';
-import * as crypto from 'crypto';
+import * as fs from 'fs';
 import * as path from 'path';
 import { fileURLToPath } from 'url';
 import dotenv from 'dotenv';
 import { retryWithBackoff, waitForSupabaseWakeup } from './retry-utils.js';
+import {
+  STORAGE_BUCKET,
+  TRACKING_FILE,
+  INVALID_TEXT_CHARS,
+  sha256,
+  chunkText,
+  compactEmbedding,
+  createEmbeddings,
+  mapWithConcurrency,
+  walkStorage,
+  findMatchingImage,
+  getImagePublicUrl,
+} from './ingest-core.js';
+import type { StorageFile } from './ingest-core.js';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -30,7 +46,12 @@ if (!SUPABASE_URL || !SUPABASE_KEY || !OPENAI_KEY) {
   process.exit(1);
 }
 
-const supabase = createClient(SUPABASE_URL, SUPABASE_KEY);
+// One long-lived client for the whole run. Node's fetch already pools keep-alive
+// connections per origin; with a service-role key there is no user session to
+// persist or refresh, so skip the auth bookkeeping on every request.
+const supabase = createClient(SUPABASE_URL, SUPABASE_KEY, {
+  auth: { persistSession: false, autoRefreshToken: false },
+});
 const openai = new OpenAI({ apiKey: OPENAI_KEY });
 
 /**
@@ -65,218 +86,294 @@ async function ensureTablesExist() {
 }
 
 // Config
-const STORAGE_BUCKET = 'tidal-docs';
 const CHUNK_SIZE = 1000; // characters (approximate)
 const CHUNK_OVERLAP = 200;
-const EMBEDDING_MODEL = 'text-embedding-3-small'; // 1536 dims
 const BATCH_SIZE = 100; // embeddings per batch
+const INSERT_BATCH_SIZE = getNumericArg('--batch-size', 50); // files per chunk/embedding insert
+const CONCURRENCY = getNumericArg('--concurrency', 8); // files downloaded/embedded in parallel
+const MAX_ROWS_PER_INSERT = 200; // chunks per insert request; bounds the embedding payload
+const VERIFY_HASH = process.argv.includes('--verify-hash'); // always download and re-hash
+const TRACKING_VERSION = 2;
 
 /**
- * Compute SHA256 hash of text content
+ * Read a numeric `--flag <n>` or `--flag=<n>` option from the command line
  */
-// Image extensions to look for
-const IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp'];
+function getNumericArg(flag: string, fallback: number): number {
+  const args = process.argv.slice(2);
+  const index = args.findIndex(arg => arg === flag || arg.startsWith(`${flag}=`));
+  if (index === -1) return fallback;
 
-function sha256(content: string): string {
-  return crypto.createHash('sha256').update(content, 'utf-8').digest('hex');
+  const raw = args[index].includes('=') ? args[index].split('=')[1] : args[index + 1];
+  const value = parseInt(raw, 10);
+  return Number.isFinite(value) && value > 0 ? value : fallback;
 }
 
 /**
- * Simple text chunker with overlap
+ * What we last saw for a storage object: its listing metadata and the hash of
+ * its content. If eTag and size still match, the hash is known without a download.
  */
-function chunkText(text: string): string[] {
-  const chunks: string[] = [];
-  let start = 0;
-  
-  while (start < text.length) {
-    const end = Math.min(start + CHUNK_SIZE, text.length);
-    chunks.push(text.slice(start, end));
-    start += CHUNK_SIZE - CHUNK_OVERLAP;
+interface TrackedFile {
+  etag: string;
+  size: number;
+  sha256: string;
+  chunks?: number; // chunks stored for this hash, from the insert response
+}
+
+interface Tracking {
+  version: number;
+  files: Record<string, TrackedFile>;
+}
+
+/**
+ * Listing metadata of a storage object, when the listing provided both fields
+ */
+interface StorageStat {
+  etag: string;
+  size: number;
+}
+
+function storageStat(file: StorageFile): StorageStat | null {
+  return file.eTag && typeof file.size === 'number'
+    ? { etag: file.eTag, size: file.size }
+    : null;
+}
+
+// Set when a tracked entry actually changes; clean runs leave the file untouched
+let trackingDirty = false;
+
+/**
+ * Storage path that owns a content hash. Owners seeded from the stored records
+ * are only claims until this run sees that path still holds the content.
+ */
+interface ContentOwner {
+  path: string;
+  confirmed: boolean;
+}
+
+// Owner of each content hash: seeded from the stored records, then the first
+// new path seen with a hash. Other paths with the same content are duplicates
+// and are not embedded again
+const contentOwners = new Map<string, ContentOwner>();
+
+/**
+ * Record that `storagePath` currently holds content `hash`: it becomes the
+ * owner if the hash has none, and confirms its claim if it already owns it
+ */
+function confirmContent(storagePath: string, hash: string) {
+  const owner = contentOwners.get(hash);
+  if (!owner) {
+    contentOwners.set(hash, { path: storagePath, confirmed: true });
+  } else if (owner.path === storagePath) {
+    owner.confirmed = true;
   }
-  
-  return chunks.length > 0 ? chunks : [text];
 }
 
 /**
- * Check if file already ingested with same hash AND has chunks
- * If hash matches but no chunks exist, returns false (needs re-ingestion)
+ * Load the local tracking file, starting fresh if it is missing or from an
+ * older format
  */
-async function isAlreadyIngested(storagePath: string, hash: string, type: 'prd' | 'design'): Promise<boolean> {
-  if (type === 'prd') {
-    const { data: prd } = await supabase
-      .from('prds')
-      .select('id, sha256')
-      .eq('storage_path', storagePath)
-      .maybeSingle();
-    
-    // If hash doesn't match, need to re-ingest
-    if (!prd || prd.sha256 !== hash) {
-      return false;
-    }
-    
-    // Hash matches, but check if chunks actually exist
-    const { data: chunks } = await supabase
-      .from('chunks')
-      .select('id')
-      .eq('prd_id', prd.id)
-      .limit(1);
-    
-    // If no chunks found, check legacy document_id
-    if (!chunks || chunks.length === 0) {
-      const { data: legacyChunks } = await supabase
-        .from('chunks')
-        .select('id')
-        .eq('document_id', prd.id)
-        .is('prd_id', null)
-        .limit(1);
-      
-      return (legacyChunks && legacyChunks.length > 0);
+function loadTracking(): Tracking {
+  try {
+    const parsed = JSON.parse(fs.readFileSync(TRACKING_FILE, 'utf-8'));
+    if (parsed?.version === TRACKING_VERSION && parsed.files) {
+      return parsed as Tracking;
     }
+  } catch (err) {
+    // Missing or unreadable - start fresh
+  }
+  return { version: TRACKING_VERSION, files: {} };
+}
+
+function updateTracked(tracking: Tracking, storagePath: string, entry: TrackedFile) {
+  const current = tracking.files[storagePath];
+  if (
+    current && current.etag === entry.etag && current.size === entry.size &&
+    current.sha256 === entry.sha256 && current.chunks === entry.chunks
+  ) {
+    return;
+  }
+  tracking.files[storagePath] = entry;
+  trackingDirty = true;
+}
+
+/**
+ * Write the tracking file only if something changed, via a temp file and
+ * rename so an interrupted run never leaves a truncated tracker behind
+ */
+function saveTracking(tracking: Tracking) {
+  if (!trackingDirty) return;
+
+  const tmpFile = `${TRACKING_FILE}.${process.pid}.tmp`;
+  fs.writeFileSync(tmpFile, JSON.stringify(tracking));
+  fs.renameSync(tmpFile, TRACKING_FILE);
+  trackingDirty = false;
+}
+
+interface ChunkRow {
+  document_id: string | null;
+  prd_id: string | null;
+  chunk_index: number;
+  content: string;
+}
+
+/**
+ * A file whose parent record is written and whose chunks are ready to insert
+ */
+interface PreparedFile {
+  storagePath: string;
+  parentId: string;
+  chunkRows: ChunkRow[];
+  embeddings: number[][];
+}
+
+interface ExistingRecord {
+  id: string;
+  sha256: string | null;
+  project_name?: string | null;
+  file_name?: string | null;
+}
+
+interface IngestResult {
+  status: string;
+  chunks: number;
+  prepared?: PreparedFile;
+  duplicateOf?: string; // path already holding the same content
+  contentHash?: string; // for deferred files: the hash whose owner is unverified
+  log: string[]; // detail lines for this file, printed with its group
+}
+
+interface IngestTarget {
+  path: string;
+  type: 'prd' | 'design';
+  existing: ExistingRecord | null;
+  stat: StorageStat | null;
+}
+
+/**
+ * Load every prd/design record up front, keyed by storage path, so the skip
+ * decision for each file needs no lookup of its own
+ */
+async function loadExistingRecords(type: 'prd' | 'design'): Promise<Map<string, ExistingRecord>> {
+  const records = new Map<string, ExistingRecord>();
+  const pageSize = 1000;
+  
+  for (let from = 0; ; from += pageSize) {
+    const { data, error } = await supabase
+      .from(type === 'prd' ? 'prds' : 'designs')
+      .select('id, sha256, storage_path, file_name' + (type === 'design' ? ', project_name' : ''))
+      .order('id')
+      .range(from, from + pageSize - 1);
     
-    return true;
-  } else {
-    const { data: doc } = await supabase
-      .from('designs')
-      .select('id, sha256')
-      .eq('storage_path', storagePath)
-      .maybeSingle();
+    if (error) throw error;
     
-    // If hash doesn't match, need to re-ingest
-    if (!doc || doc.sha256 !== hash) {
-      return false;
+    for (const row of (data ?? []) as unknown as (ExistingRecord & { storage_path: string })[]) {
+      records.set(row.storage_path, row);
     }
     
-    // Hash matches, but check if chunks actually exist
-    const { data: chunks } = await supabase
-      .from('chunks')
-      .select('id')
-      .eq('document_id', doc.id)
-      .limit(1);
-    
-    return (chunks && chunks.length > 0);
+    if (!data || data.length < pageSize) break;
   }
+  
+  return records;
 }
 
 /**
- * Recursively list all files in Supabase Storage
+ * Count the chunks stored for a file that is already ingested with the same hash
+ * Returns 0 if the hash differs or no chunks exist (needs re-ingestion)
  */
-async function listStorageFilesRecursive(folderPath: string = ''): Promise<string[]> {
-  console.log(`  🔍 Scanning: ${folderPath || 'root'}`);
-  
-  const { data, error } = await supabase.storage
-    .from(STORAGE_BUCKET)
-    .list(folderPath, {
-      limit: 1000,
-      sortBy: { column: 'name', order: 'asc' }
-    });
-  
-  if (error) {
-    console.error(`  ❌ Error listing ${folderPath}:`, error);
-    return [];
-  }
-  
-  if (!data || data.length === 0) {
-    console.log(`  📭 Empty: ${folderPath}`);
-    return [];
+async function countIngestedChunks(existing: ExistingRecord | null, hash: string, type: 'prd' | 'design'): Promise<number> {
+  // If hash doesn't match, need to re-ingest
+  if (!existing || existing.sha256 !== hash) {
+    return 0;
   }
   
-  const files: string[] = [];
-  
-  for (const item of data) {
-    const itemPath = folderPath ? `${folderPath}/${item.name}` : item.name;
-    
-    // Check if it's a file or folder
-    // In Supabase Storage: folders have id === null, files have an id
-    // However, we also check for file extensions to be sure
-    const hasFileExtension = item.name.match(/\.(txt|md|json|pdf|ts|js|py|go|java|cpp|c|h|rb|php|rs|sh)$/i);
-    
-    if (hasFileExtension) {
-      // Definitely a file (has extension)
-      console.log(`  📄 File: ${item.name}`);
-      files.push(itemPath);
-    } else if (item.id === null) {
-      // No ID = folder in Supabase Storage
-      console.log(`  📁 Folder: ${item.name}`);
-      const subFiles = await listStorageFilesRecursive(itemPath);
-      files.push(...subFiles);
-    } else {
-      // Has ID but no extension - could be a file without extension or edge case
-      // Try recursing first (safer - if it's a folder, we'll find files inside)
-      // If it fails or returns nothing, it's likely a file without extension
-      console.log(`  ❓ Checking: ${item.name} (has ID but no extension)`);
-      const subFiles = await listStorageFilesRecursive(itemPath);
-      if (subFiles.length > 0) {
-        // It was a folder, got files
-        files.push(...subFiles);
-      } else {
-        // No files found inside, treat as file anyway (might be file without extension)
-        console.log(`  📄 Treating as file: ${item.name}`);
-        files.push(itemPath);
-      }
-    }
+  if (type === 'prd') {
+    // Hash matches, but check if chunks actually exist (including legacy
+    // chunks linked through document_id)
+    const { count } = await supabase
+      .from('chunks')
+      .select('id', { count: 'exact', head: true })
+      .or(`prd_id.eq.${existing.id},and(prd_id.is.null,document_id.eq.${existing.id})`);
+    
+    return count ?? 0;
+  } else {
+    // Hash matches, but check if chunks actually exist
+    const { count } = await supabase
+      .from('chunks')
+      .select('id', { count: 'exact', head: true })
+      .eq('document_id', existing.id);
+    
+    return count ?? 0;
   }
-  
-  return files;
 }
 
 /**
- * Download file content from Supabase Storage with retry
+ * Count the chunks stored for a page of prd/design records, including legacy
+ * PRD chunks linked through document_id. Returns null if a count fails.
  */
+async function countChunksFor(ids: string[], type: 'prd' | 'design'): Promise<number | null> {
+  const idList = ids.join(',');
+  const { count, error } = await supabase
+    .from('chunks')
+    .select('id', { count: 'exact', head: true })
+    .or(type === 'prd'
+      ? `prd_id.in.(${idList}),and(prd_id.is.null,document_id.in.(${idList}))`
+      : `document_id.in.(${idList})`);
+  
+  return error ? null : count;
+}
+
 /**
- * Find ANY image file in the same folder as the JSON/text file
- * This is more flexible and works with any naming convention
+ * Drop recorded chunk counts the chunks table no longer backs up. Counts are
+ * compared per page of tracked records, so chunks written for other records
+ * (by ingest-worker.ts or reingest-prd.ts) cannot hide a loss. Returns the
+ * number of tracked files whose counts were dropped.
  */
-async function findMatchingImage(filePath: string): Promise<string | null> {
-  const dir = path.dirname(filePath);
-  
-  try {
-    // List all files in the same folder
-    const { data: files, error } = await supabase.storage
-      .from(STORAGE_BUCKET)
-      .list(dir, {
-        limit: 100,
-        sortBy: { column: 'name', order: 'asc' }
-      });
-    
-    if (error || !files) {
-      return null;
+async function reconcileTrackedChunks(
+  tracking: Tracking,
+  records: Map<string, ExistingRecord>,
+  type: 'prd' | 'design'
+): Promise<number> {
+  const tracked: { storagePath: string; id: string; chunks: number }[] = [];
+  for (const [storagePath, entry] of Object.entries(tracking.files)) {
+    const record = records.get(storagePath);
+    if (entry.chunks && record && record.sha256 === entry.sha256) {
+      tracked.push({ storagePath, id: record.id, chunks: entry.chunks });
     }
+  }
+  
+  // Keeps the in(...) filters well within URL length limits
+  const pageSize = 50;
+  let dropped = 0;
+  
+  for (let i = 0; i < tracked.length; i += pageSize) {
+    const page = tracked.slice(i, i + pageSize);
+    const stored = await countChunksFor(page.map(file => file.id), type);
+    const expected = page.reduce((sum, file) => sum + file.chunks, 0);
     
-    // Find the first image file in the folder
-    for (const file of files) {
-      const isImage = IMAGE_EXTENSIONS.some(ext => 
-        file.name.toLowerCase().endsWith(ext)
-      );
-      
-      if (isImage && file.metadata) {
-        return `${dir}/${file.name}`;
+    if (stored !== null && stored !== expected) {
+      for (const file of page) {
+        updateTracked(tracking, file.storagePath, { ...tracking.files[file.storagePath], chunks: undefined });
       }
+      dropped += page.length;
     }
-    
-    return null;
-  } catch (err) {
-    return null;
   }
+  
+  return dropped;
 }
 
 /**
- * Get public URL for an image in storage
- * Properly encodes the path to handle special characters like colons
+ * Only designs/team/project/file/... paths carry project_name and file_name.
+ * Shorter paths (designs/Project/Screen) can never be backfilled, so they
+ * must not keep a design off the no-download path.
  */
-function getImagePublicUrl(imagePath: string): string {
-  const { data } = supabase.storage
-    .from(STORAGE_BUCKET)
-    .getPublicUrl(imagePath);
-  
-  // The URL might contain unencoded colons and other special chars
-  // Split by slashes, encode each part, then rejoin
-  const url = new URL(data.publicUrl);
-  const pathParts = url.pathname.split('/').map(part => encodeURIComponent(decodeURIComponent(part)));
-  url.pathname = pathParts.join('/');
-  
-  return url.toString();
+function canBackfillFromPath(storagePath: string): boolean {
+  const parts = storagePath.split('/');
+  return parts[0] === 'designs' && parts.length >= 6;
 }
 
+/**
+ * Download file content from Supabase Storage with retry
+ */
 async function downloadFile(path: string): Promise<string> {
   return retryWithBackoff(
     async () => {
@@ -306,30 +403,19 @@ async function downloadFile(path: string): Promise<string> {
           let pdfText = pdfData.text || '';
           
           if (!pdfText || pdfText.trim().length === 0) {
-            console.warn(`   ⚠️  PDF appears to be image-based (no extractable text)`);
-            console.warn(`   📄 This PDF contains scanned images instead of selectable text.`);
-            console.warn(`   💡 To enable OCR for image-based PDFs, you would need to:`);
-            console.warn(`      1. Install system dependencies: brew install pkg-config cairo pango libpng jpeg giflib librsvg`);
-            console.warn(`      2. Install npm packages: npm install canvas pdfjs-dist tesseract.js`);
-            console.warn(`   ❌ This PDF cannot be ingested without OCR. It will be skipped.`);
+            // Image-based (scanned) PDF; OCR would need canvas, pdfjs-dist and tesseract.js
             throw new Error('PDF is image-based (scanned) and has no extractable text. OCR is not currently configured.');
           }
           
-          // Remove invalid Unicode surrogates (common issue with PDF extraction)
-          pdfText = pdfText.replace(/[\uD800-\uDFFF]/g, '');
-          
-          // Remove other problematic characters
-          pdfText = pdfText
-            .replace(/\0/g, '')  // Null bytes
-            .replace(/[\x01-\x08\x0B-\x0C\x0E-\x1F\x7F]/g, '');  // Control chars
+          // Remove invalid Unicode surrogates, null bytes and control chars
+          pdfText = pdfText.replace(INVALID_TEXT_CHARS, '');
           
           // Normalize whitespace (PDFs often have weird spacing)
           pdfText = pdfText.replace(/\s+/g, ' ').trim();
           
           return pdfText;
         } catch (pdfError) {
-          // Fallback: try basic extraction or return empty
-          console.warn(`⚠️  Could not parse PDF ${path}:`, pdfError);
+          // Reported by the caller together with the rest of the file's output
           throw new Error(`PDF parsing failed: ${pdfError instanceof Error ? pdfError.message : 'Unknown error'}`);
         }
       }
@@ -344,45 +430,124 @@ async function downloadFile(path: string): Promise<string> {
 }
 
 /**
- * Create embeddings in batches
+ * Delete a prd/design record and its chunks (embeddings cascade with them)
  */
-async function createEmbeddings(texts: string[]): Promise<number[][]> {
-  const embeddings: number[][] = [];
-  
-  for (let i = 0; i < texts.length; i += BATCH_SIZE) {
-    const batch = texts.slice(i, i + BATCH_SIZE);
-    const response = await openai.embeddings.create({
-      model: EMBEDDING_MODEL,
-      input: batch,
-    });
-    embeddings.push(...response.data.map(e => e.embedding));
-    
-    if (i + BATCH_SIZE < texts.length) {
-      await new Promise(resolve => setTimeout(resolve, 1000)); // rate limit
-    }
-  }
+async function removeRecord(record: ExistingRecord, type: 'prd' | 'design') {
+  const { error: chunkError } = await supabase
+    .from('chunks')
+    .delete()
+    .eq(type === 'prd' ? 'prd_id' : 'document_id', record.id);
+  
+  if (chunkError) throw chunkError;
   
-  return embeddings;
+  const { error } = await supabase
+    .from(type === 'prd' ? 'prds' : 'designs')
+    .delete()
+    .eq('id', record.id);
+  
+  if (error) throw error;
 }
 
 /**
- * Ingest a single file from Supabase Storage
+ * Ingest a single file from Supabase Storage. Detail lines go into the
+ * result's log and are printed with the file's group, so output from files
+ * processed concurrently does not interleave.
  */
 async function ingestFileFromStorage(
   storagePath: string,
-  type: 'prd' | 'design'
-): Promise<{ status: string; chunks: number }> {
+  type: 'prd' | 'design',
+  existing: ExistingRecord | null,
+  stat: StorageStat | null,
+  tracking: Tracking
+): Promise<IngestResult> {
+  const log: string[] = [];
   try {
+    // Unchanged storage object whose known hash is already ingested: skip without
+    // downloading. Designs still missing backfill metadata take the slow path.
+    // If the tracker recorded the chunks stored for that hash, trust it
+    // instead of probing the chunks table; otherwise probe once and record
+    // the count so later runs don't probe again.
+    const tracked = tracking.files[storagePath];
+    const needsBackfill = type === 'design' && canBackfillFromPath(storagePath) &&
+      (!existing?.project_name || !existing?.file_name);
+    if (
+      !VERIFY_HASH && stat && tracked && !needsBackfill &&
+      tracked.etag === stat.etag && tracked.size === stat.size
+    ) {
+      // Known duplicate: its own record was removed, another path holds the
+      // content. Until that path is seen this run, wait for it.
+      const owner = contentOwners.get(tracked.sha256);
+      if (!existing && owner && owner.path !== storagePath) {
+        return owner.confirmed
+          ? { status: 'duplicate', chunks: 0, duplicateOf: owner.path, log }
+          : { status: 'deferred', chunks: 0, duplicateOf: owner.path, contentHash: tracked.sha256, log };
+      }
+      
+      if (tracked.chunks) {
+        if (existing?.sha256 === tracked.sha256) {
+          confirmContent(storagePath, tracked.sha256);
+          return { status: 'skipped', chunks: 0, log };
+        }
+      } else {
+        const storedChunks = await countIngestedChunks(existing, tracked.sha256, type);
+        if (storedChunks > 0) {
+          confirmContent(storagePath, tracked.sha256);
+          updateTracked(tracking, storagePath, { ...tracked, chunks: storedChunks });
+          return { status: 'skipped', chunks: 0, log };
+        }
+      }
+    }
+    
     // Read content from Supabase Storage (temporary download to memory)
     const content = await downloadFile(storagePath);
     
-    if (!content || content.trim().length === 0) {
-      console.error(`\n  ⚠️  File is empty or invalid`);
-      return { status: 'failed', chunks: 0 };
+    if (!content || !/\S/.test(content)) {
+      log.push(`  ⚠️  File is empty or invalid`);
+      return { status: 'failed', chunks: 0, log };
     }
     
     const hash = sha256(content);
     
+    // This path no longer holds its stored content, so it no longer owns it
+    if (existing?.sha256 && existing.sha256 !== hash &&
+        contentOwners.get(existing.sha256)?.path === storagePath) {
+      contentOwners.delete(existing.sha256);
+    }
+    
+    // Identical content already ingested (or being ingested) under another path.
+    // A path whose own record already holds this hash owns it as well. An owner
+    // not yet seen this run may have changed since, so nothing is skipped or
+    // removed on its word - the file is retried after the walk.
+    const owner = contentOwners.get(hash);
+    if (owner && owner.path !== storagePath && existing?.sha256 !== hash) {
+      if (!owner.confirmed) {
+        return { status: 'deferred', chunks: 0, duplicateOf: owner.path, contentHash: hash, log };
+      }
+      if (existing) {
+        // Content changed into a copy of another file - its old chunks are stale
+        await removeRecord(existing, type);
+        log.push(`  🗑️  Removed stale record (content now matches ${owner.path})`);
+      }
+      if (stat) {
+        updateTracked(tracking, storagePath, { ...stat, sha256: hash });
+      }
+      return { status: 'duplicate', chunks: 0, duplicateOf: owner.path, log };
+    }
+    confirmContent(storagePath, hash);
+    
+    // Check if already ingested with same hash; the count it finds (if any)
+    // is recorded so the next run can skip without probing
+    const storedChunks = await countIngestedChunks(existing, hash, type);
+    const alreadyIngested = storedChunks > 0;
+    
+    if (stat) {
+      updateTracked(tracking, storagePath, {
+        ...stat,
+        sha256: hash,
+        chunks: alreadyIngested ? storedChunks : undefined,
+      });
+    }
+    
     // Extract path information first (needed for backfill check)
     const pathParts = storagePath.split('/');
     const fileName = pathParts.pop()!;
@@ -400,12 +565,12 @@ async function ingestFileFromStorage(
         fileNameFromPath = pathParts[3].replace(/_\d+:\d+$/, ''); // File name
         title = pathParts[4].replace(/_\d+:\d+$/, ''); // Page name (2 levels back from screen)
         
-        console.log(`     📁 Design hierarchy with team detected:`);
-        console.log(`        Team: ${teamName}`);
-        console.log(`        Project: ${projectName}`);
-        console.log(`        File: ${fileNameFromPath}`);
-        console.log(`        Page: ${title}`);
-        console.log(`        Full path: ${storagePath}`);
+        log.push(`     📁 Design hierarchy with team detected:`);
+        log.push(`        Team: ${teamName}`);
+        log.push(`        Project: ${projectName}`);
+        log.push(`        File: ${fileNameFromPath}`);
+        log.push(`        Page: ${title}`);
+        log.push(`        Full path: ${storagePath}`);
       } else if (pathParts.length >= 5 && pathParts[0] === 'designs') {
         // Legacy: designs/team/project/file/page (no screen folder level)
         // Or: designs/team/page/screen (old structure)
@@ -420,20 +585,20 @@ async function ingestFileFromStorage(
           fileNameFromPath = pathParts[3].replace(/_\d+:\d+$/, ''); // File name
         }
         
-        console.log(`     📁 Design hierarchy with team detected (legacy):`);
-        console.log(`        Team: ${teamName}`);
-        console.log(`        Project: ${projectName}`);
-        console.log(`        File: ${fileNameFromPath}`);
-        console.log(`        Document: ${title}`);
-        console.log(`        Full path: ${storagePath}`);
+        log.push(`     📁 Design hierarchy with team detected (legacy):`);
+        log.push(`        Team: ${teamName}`);
+        log.push(`        Project: ${projectName}`);
+        log.push(`        File: ${fileNameFromPath}`);
+        log.push(`        Document: ${title}`);
+        log.push(`        Full path: ${storagePath}`);
       } else {
         // Structure: designs/ProjectName/ScreenName (no team folder)
         const parentFolderName = pathParts[pathParts.length - 2];
         const cleanParentName = parentFolderName.replace(/_\d+:\d+$/, '');
         title = cleanParentName;
         
-        console.log(`     📁 Design hierarchy detected:`);
-        console.log(`        Document: ${title}`);
+        log.push(`     📁 Design hierarchy detected:`);
+        log.push(`        Document: ${title}`);
       }
     } else if (type === 'prd' && pathParts.length >= 3 && pathParts[0] === 'prds') {
       // Structure: prds/team_name/file_name
@@ -442,28 +607,21 @@ async function ingestFileFromStorage(
       // Use the actual file name (with extension) as file_name
       title = fileName;
       
-      console.log(`     📁 PRD with team detected:`);
-      console.log(`        Team: ${teamName}`);
-      console.log(`        File: ${title}`);
+      log.push(`     📁 PRD with team detected:`);
+      log.push(`        Team: ${teamName}`);
+      log.push(`        File: ${title}`);
     } else {
       // Use filename for simple structures
       title = fileName.replace(/\.(txt|md|json|pdf)$/, '');
     }
     
-    // Check if already ingested with same hash
-    const alreadyIngested = await isAlreadyIngested(storagePath, hash, type);
-    
     // Check if we need to backfill project_name/file_name even if already ingested
     if (alreadyIngested && type === 'design') {
-      const { data: existingDoc } = await supabase
-        .from('designs')
-        .select('id, project_name, file_name')
-        .eq('storage_path', storagePath)
-        .maybeSingle();
+      const existingDoc = existing;
       
       if (existingDoc && (!existingDoc.project_name || !existingDoc.file_name)) {
         // Need to backfill - update metadata without re-creating chunks
-        console.log(`     🔄 Backfilling project_name/file_name for existing record`);
+        log.push(`     🔄 Backfilling project_name/file_name for existing record`);
         const updateData: Record<string, string> = {};
         if (!existingDoc.project_name && projectName) updateData.project_name = projectName;
         if (!existingDoc.file_name && fileNameFromPath) updateData.file_name = fileNameFromPath;
@@ -473,55 +631,52 @@ async function ingestFileFromStorage(
             .from('designs')
             .update(updateData)
             .eq('id', existingDoc.id);
-          console.log(`     ✅ Backfilled metadata: ${JSON.stringify(updateData)}`);
+          log.push(`     ✅ Backfilled metadata: ${JSON.stringify(updateData)}`);
         }
-        return { status: 'skipped', chunks: 0 };
+        return { status: 'skipped', chunks: 0, log };
       }
     }
     
     if (alreadyIngested) {
-      return { status: 'skipped', chunks: 0 };
+      return { status: 'skipped', chunks: 0, log };
     }
     
     // Look for matching image
-    const imagePath = await findMatchingImage(storagePath);
-    const imageUrl = imagePath ? getImagePublicUrl(imagePath) : null;
+    const imagePath = await findMatchingImage(supabase, storagePath);
+    const imageUrl = imagePath ? getImagePublicUrl(supabase, imagePath) : null;
     
     if (imagePath) {
-      console.log(`  🖼️  Found screenshot: ${path.basename(imagePath)}`);
+      log.push(`  🖼️  Found screenshot: ${path.basename(imagePath)}`);
     }
     
     // Extract figma_url from JSON design files (from identifiers.figmaUrl)
+    // Full design exports can be megabytes; only parse them when the key is present
     let figmaUrl: string | null = null;
-    if (type === 'design' && fileName.endsWith('.json')) {
+    if (type === 'design' && fileName.endsWith('.json') && content.includes('"figmaUrl"')) {
       try {
         const jsonData = JSON.parse(content);
         figmaUrl = jsonData.identifiers?.figmaUrl || jsonData.figmaUrl || null;
         if (figmaUrl) {
-          console.log(`  📎 Extracted Figma URL: ${figmaUrl.substring(0, 80)}...`);
+          log.push(`  📎 Extracted Figma URL: ${figmaUrl.substring(0, 80)}...`);
         }
       } catch (e) {
         // Not valid JSON or missing identifiers - skip figma_url extraction
-        console.log(`  ⚠️  Could not extract figma_url from JSON: ${fileName}`);
+        log.push(`  ⚠️  Could not extract figma_url from JSON: ${fileName}`);
       }
     }
     
     // Chunk content
-    const chunks = chunkText(content);
+    const chunks = chunkText(content, CHUNK_SIZE, CHUNK_OVERLAP);
     
     // Create embeddings
-    const embeddings = await createEmbeddings(chunks);
+    const embeddings = await createEmbeddings(openai, chunks, BATCH_SIZE, 1000);
     
     let docId: string;
     let isPrd = type === 'prd';
     
     if (isPrd) {
       // Handle PRDs in the prds table
-      const { data: existingPrd } = await supabase
-        .from('prds')
-        .select('id')
-        .eq('storage_path', storagePath)
-        .maybeSingle();
+      const existingPrd = existing;
       
       if (existingPrd) {
         // Update existing PRD
@@ -555,11 +710,7 @@ async function ingestFileFromStorage(
       }
     } else {
       // Handle designs in the designs table
-      const { data: existingDoc } = await supabase
-        .from('designs')
-        .select('id')
-        .eq('storage_path', storagePath)
-        .maybeSingle();
+      const existingDoc = existing;
       
       if (existingDoc) {
         // Update existing document
@@ -607,46 +758,163 @@ async function ingestFileFromStorage(
       }
     }
     
-    // Insert chunks directly to document or prd
-    console.log(`     📄 Inserting ${chunks.length} chunks...`);
-    const chunkRows = chunks.map((content, i) => ({
+    // Chunk rows are inserted later together with the rest of the batch
+    const chunkRows: ChunkRow[] = chunks.map((content, i) => ({
       document_id: isPrd ? null : docId,
       prd_id: isPrd ? docId : null,
       chunk_index: i,
       content,
     }));
     
-    const { data: chunkData, error: chunkError } = await supabase
-      .from('chunks')
-      .insert(chunkRows)
-      .select('id');
-    
-    if (chunkError) throw chunkError;
-    
-    console.log(`     ✅ Created ${chunkData.length} chunks`);
-    
-    // Insert embeddings
-    const embeddingRows = chunkData.map((chunk, i) => ({
-      chunk_id: chunk.id,
-      embedding: embeddings[i],
-    }));
-    
-    const { error: embError } = await supabase
-      .from('chunk_embeddings')
-      .insert(embeddingRows);
-    
-    if (embError) throw embError;
-    
-    return { status: 'ingested', chunks: chunkData.length };
+    return {
+      status: 'prepared',
+      chunks: chunkRows.length,
+      prepared: { storagePath, parentId: docId, chunkRows, embeddings },
+      log,
+    };
   } catch (error: unknown) {
     if (error instanceof Error) {
-      console.error(`\n  ❌ Error: ${error.message}`);
-      console.error(`  Stack: ${error.stack?.split('\n')[1]?.trim()}`);
+      log.push(`  ❌ Error: ${error.message}`);
+      log.push(`  Stack: ${error.stack?.split('\n')[1]?.trim()}`);
     } else {
-      console.error(`\n  ❌ Error: ${JSON.stringify(error, null, 2)}`);
+      log.push(`  ❌ Error: ${JSON.stringify(error, null, 2)}`);
+    }
+    return { status: 'failed', chunks: 0, log };
+  }
+}
+
+/**
+ * Delete chunks by id, a bounded number of ids per request
+ */
+async function deleteChunks(ids: string[]) {
+  for (let i = 0; i < ids.length; i += MAX_ROWS_PER_INSERT) {
+    await supabase
+      .from('chunks')
+      .delete()
+      .in('id', ids.slice(i, i + MAX_ROWS_PER_INSERT));
+  }
+}
+
+/**
+ * Insert one group of file slices: a multi-row insert into chunks, then one
+ * into chunk_embeddings. If the embeddings insert fails the group's chunks
+ * are removed again. Returns the inserted chunk ids per storage path.
+ */
+async function insertGroup(group: PreparedFile[]): Promise<Map<string, string[]>> {
+  const chunkRows = group.flatMap(file => file.chunkRows);
+  const embeddings = group.flatMap(file => file.embeddings);
+  
+  const { data: chunkData, error: chunkError } = await supabase
+    .from('chunks')
+    .insert(chunkRows)
+    .select('id, document_id, prd_id');
+  
+  if (chunkError) throw chunkError;
+  
+  const embeddingRows = chunkData.map((chunk, i) => ({
+    chunk_id: chunk.id,
+    embedding: compactEmbedding(embeddings[i]),
+  }));
+  
+  const { error: embError } = await supabase
+    .from('chunk_embeddings')
+    .insert(embeddingRows);
+  
+  if (embError) {
+    await deleteChunks(chunkData.map(chunk => chunk.id));
+    throw embError;
+  }
+  
+  // Map returned rows back to their files for per-file reporting
+  const pathByParent = new Map(group.map(file => [file.parentId, file.storagePath]));
+  const inserted = new Map<string, string[]>();
+  for (const chunk of chunkData) {
+    const storagePath = pathByParent.get(chunk.prd_id ?? chunk.document_id);
+    if (!storagePath) continue;
+    const ids = inserted.get(storagePath);
+    if (ids) ids.push(chunk.id);
+    else inserted.set(storagePath, [chunk.id]);
+  }
+  return inserted;
+}
+
+/**
+ * Split a file into slices of at most MAX_ROWS_PER_INSERT chunks, so even a
+ * multi-megabyte design export never goes out as one unbounded request
+ */
+function sliceFile(file: PreparedFile): PreparedFile[] {
+  const slices: PreparedFile[] = [];
+  for (let i = 0; i < file.chunkRows.length; i += MAX_ROWS_PER_INSERT) {
+    slices.push({
+      ...file,
+      chunkRows: file.chunkRows.slice(i, i + MAX_ROWS_PER_INSERT),
+      embeddings: file.embeddings.slice(i, i + MAX_ROWS_PER_INSERT),
+    });
+  }
+  return slices;
+}
+
+/**
+ * Insert the chunks of every file in the batch with a few multi-row inserts
+ * instead of two round trips per file. Files are sliced and grouped so each
+ * request carries at most MAX_ROWS_PER_INSERT rows, which keeps the
+ * serialized embedding payload bounded. If any slice of a file fails, the
+ * chunks already stored for its other slices are removed, so a file never
+ * looks ingested without all of its embeddings.
+ * Returns the number of chunks the database accepted per storage path.
+ */
+async function flushBatch(batch: PreparedFile[]): Promise<Map<string, number>> {
+  const created = new Map<string, number>();
+  if (batch.length === 0) return created;
+  
+  const groups: PreparedFile[][] = [];
+  let group: PreparedFile[] = [];
+  let rows = 0;
+  for (const slice of batch.flatMap(sliceFile)) {
+    if (group.length > 0 && rows + slice.chunkRows.length > MAX_ROWS_PER_INSERT) {
+      groups.push(group);
+      group = [];
+      rows = 0;
+    }
+    group.push(slice);
+    rows += slice.chunkRows.length;
+  }
+  groups.push(group);
+  
+  const totalRows = batch.reduce((sum, file) => sum + file.chunkRows.length, 0);
+  console.log(`\n📄 Inserting ${totalRows} chunks for ${batch.length} files in ${groups.length} requests...`);
+  
+  const insertedIds = new Map<string, string[]>();
+  const failedPaths = new Set<string>();
+  for (const slices of groups) {
+    // Later slices of a file that already failed are not sent
+    const pending = slices.filter(slice => !failedPaths.has(slice.storagePath));
+    if (pending.length === 0) continue;
+    
+    try {
+      const inserted = await insertGroup(pending);
+      for (const [storagePath, ids] of inserted) {
+        const existingIds = insertedIds.get(storagePath);
+        if (existingIds) existingIds.push(...ids);
+        else insertedIds.set(storagePath, ids);
+      }
+    } catch (error: unknown) {
+      const message = error instanceof Error ? error.message : JSON.stringify(error);
+      const paths = new Set(pending.map(slice => slice.storagePath));
+      console.error(`  ❌ Insert failed for ${paths.size} files: ${message}`);
+      
+      for (const storagePath of paths) {
+        failedPaths.add(storagePath);
+        await deleteChunks(insertedIds.get(storagePath) ?? []);
+        insertedIds.delete(storagePath);
+      }
     }
-    return { status: 'failed', chunks: 0 };
   }
+  
+  for (const [storagePath, ids] of insertedIds) {
+    created.set(storagePath, ids.length);
+  }
+  return created;
 }
 
 /**
@@ -669,65 +937,188 @@ async function main() {
   // Ensure database tables exist
   await ensureTablesExist();
   
-  // List files in storage recursively
-  console.log('🔍 Scanning Supabase Storage...\n');
-  const prdFiles = await listStorageFilesRecursive('prds');
-  const designFiles = await listStorageFilesRecursive('designs');
-  
-  console.log(`\n✅ Found ${prdFiles.length + designFiles.length} files (${prdFiles.length} PRDs, ${designFiles.length} designs)\n`);
-  
   let ingested = 0;
   let skipped = 0;
+  let duplicates = 0;
   let failed = 0;
   let totalChunks = 0;
+  let batch: PreparedFile[] = [];
+  let deferred: { target: IngestTarget; hash: string }[] = [];
+  const tracking = loadTracking();
   
-  // Process PRDs
-  for (const file of prdFiles) {
-    const fileName = file.split('/').pop()!;
-    process.stdout.write(`Processing ${fileName}...`);
-    const result = await ingestFileFromStorage(file, 'prd');
-    
-    if (result.status === 'ingested') {
-      console.log(` ✅ ${result.chunks} chunks`);
-      ingested++;
-      totalChunks += result.chunks;
-    } else if (result.status === 'skipped') {
-      console.log(` ⏭️  unchanged`);
-      skipped++;
-    } else {
-      console.log(` ❌ failed`);
-      failed++;
+  const flush = async () => {
+    try {
+      const created = await flushBatch(batch);
+      const lines: string[] = [];
+      for (const file of batch) {
+        const fileName = file.storagePath.split('/').pop()!;
+        const count = created.get(file.storagePath) ?? 0;
+        if (count > 0) {
+          lines.push(`  ✅ ${fileName}: ${count} chunks`);
+          ingested++;
+          totalChunks += count;
+          const tracked = tracking.files[file.storagePath];
+          if (tracked) {
+            updateTracked(tracking, file.storagePath, { ...tracked, chunks: count });
+          }
+        } else {
+          lines.push(`  ❌ ${fileName}: no chunks stored`);
+          failed++;
+        }
+      }
+      if (lines.length > 0) {
+        process.stdout.write(lines.join('\n') + '\n');
+      }
+    } catch (error: unknown) {
+      const message = error instanceof Error ? error.message : JSON.stringify(error);
+      console.error(`  ❌ Batch insert failed: ${message}`);
+      failed += batch.length;
+    }
+    batch = [];
+  };
+  
+  // Fetch existing records once so every skip decision is ready before the loop
+  const existingPrds = await loadExistingRecords('prd');
+  const existingDesigns = await loadExistingRecords('design');
+  
+  // Dedup across runs: every stored record owns its content hash
+  for (const records of [existingPrds, existingDesigns]) {
+    for (const [storagePath, record] of records) {
+      if (record.sha256 && !contentOwners.has(record.sha256)) {
+        contentOwners.set(record.sha256, { path: storagePath, confirmed: false });
+      }
     }
   }
   
-  // Process designs
-  for (const file of designFiles) {
-    const fileName = file.split('/').pop()!;
-    process.stdout.write(`Processing ${fileName}...`);
-    const result = await ingestFileFromStorage(file, 'design');
-    
-    if (result.status === 'ingested') {
-      console.log(` ✅ ${result.chunks} chunks`);
-      ingested++;
-      totalChunks += result.chunks;
-    } else if (result.status === 'skipped') {
-      console.log(` ⏭️  unchanged`);
-      skipped++;
-    } else {
-      console.log(` ❌ failed`);
-      failed++;
+  // Recorded chunk counts must still match the chunks table, or those files
+  // are probed (and re-ingested if their chunks are gone) on this run
+  const recounted =
+    await reconcileTrackedChunks(tracking, existingPrds, 'prd') +
+    await reconcileTrackedChunks(tracking, existingDesigns, 'design');
+  if (recounted > 0) {
+    console.log(`⚠️  Chunk counts changed for up to ${recounted} tracked files - re-checking them\n`);
+  }
+  
+  let prdCount = 0;
+  let designCount = 0;
+  
+  // Files are produced lazily from the storage walk, so only one group of
+  // paths (plus the pending insert batch) is held in memory at a time
+  async function* iterFiles(): AsyncGenerator<IngestTarget> {
+    for await (const file of walkStorage(supabase, 'prds')) {
+      prdCount++;
+      yield {
+        path: file.path,
+        type: 'prd' as const,
+        existing: existingPrds.get(file.path) ?? null,
+        stat: storageStat(file),
+      };
+    }
+    for await (const file of walkStorage(supabase, 'designs')) {
+      designCount++;
+      yield {
+        path: file.path,
+        type: 'design' as const,
+        existing: existingDesigns.get(file.path) ?? null,
+        stat: storageStat(file),
+      };
     }
   }
   
+  // Download, hash and embed files concurrently; database writes still go out per batch
+  const processGroup = async (group: IngestTarget[]) => {
+    const results = await mapWithConcurrency(group, CONCURRENCY, file =>
+      ingestFileFromStorage(file.path, file.type, file.existing, file.stat, tracking)
+    );
+    
+    // One write per group instead of one per file; each file's detail lines
+    // follow its own Processing line
+    const lines: string[] = [];
+    results.forEach((result, i) => {
+      const fileName = group[i].path.split('/').pop()!;
+      
+      if (result.status === 'prepared' && result.prepared) {
+        lines.push(`Processing ${fileName}... 📦 ${result.chunks} chunks queued`);
+        batch.push(result.prepared);
+      } else if (result.status === 'skipped') {
+        lines.push(`Processing ${fileName}... ⏭️  unchanged`);
+        skipped++;
+      } else if (result.status === 'duplicate') {
+        lines.push(`Processing ${fileName}... ♊ duplicate of ${result.duplicateOf}`);
+        duplicates++;
+      } else if (result.status === 'deferred') {
+        lines.push(`Processing ${fileName}... ⏳ waiting for ${result.duplicateOf}`);
+        deferred.push({ target: group[i], hash: result.contentHash! });
+      } else {
+        lines.push(`Processing ${fileName}... ❌ failed`);
+        failed++;
+      }
+      lines.push(...result.log);
+    });
+    if (lines.length > 0) {
+      process.stdout.write(lines.join('\n') + '\n');
+    }
+    
+    if (batch.length >= INSERT_BATCH_SIZE) {
+      await flush();
+    }
+  };
+  
+  console.log('🔍 Scanning Supabase Storage...\n');
+  let group: IngestTarget[] = [];
+  for await (const file of iterFiles()) {
+    group.push(file);
+    if (group.length >= INSERT_BATCH_SIZE) {
+      await processGroup(group);
+      group = [];
+    }
+  }
+  await processGroup(group);
+  
+  // Every path has been seen now. Owners still unconfirmed no longer hold
+  // that content (changed, deleted or failed), so the files waiting on them
+  // are ingested in their own right.
+  if (deferred.length > 0) {
+    const retry = deferred;
+    deferred = [];
+    for (const { hash } of retry) {
+      if (contentOwners.get(hash)?.confirmed === false) {
+        contentOwners.delete(hash);
+      }
+    }
+    
+    console.log(`\n🔁 Re-checking ${retry.length} files that matched unverified content...\n`);
+    for (let i = 0; i < retry.length; i += INSERT_BATCH_SIZE) {
+      await processGroup(retry.slice(i, i + INSERT_BATCH_SIZE).map(file => file.target));
+    }
+    // Every owner left is confirmed, so nothing should wait twice
+    failed += deferred.length;
+  }
+  
+  await flush();
+  
   // Summary
   console.log('\n' + '='.repeat(60));
   console.log('📊 Summary');
   console.log('='.repeat(60));
+  console.log(`📁 Found: ${prdCount + designCount} files (${prdCount} PRDs, ${designCount} designs)`);
   console.log(`✅ Ingested: ${ingested} files (${totalChunks} chunks)`);
   console.log(`⏭️  Skipped: ${skipped} files`);
+  if (duplicates > 0) {
+    console.log(`♊ Duplicates: ${duplicates} files (identical content ingested under another path)`);
+  }
   if (failed > 0) {
     console.log(`❌ Failed: ${failed} files`);
   }
+  
+  // One authoritative count at the end instead of per-file probes
+  const { count: chunkCount } = await supabase
+    .from('chunks')
+    .select('*', { count: 'exact', head: true });
+  if (chunkCount !== null) {
+    console.log(`📚 Knowledge base: ${chunkCount} chunks`);
+  }
+  saveTracking(tracking);
   console.log();
 }
 
@@ -7,11 +7,17 @@
 
 import { createClient } from '@supabase/supabase-js';
 import OpenAI from 'openai';
-import * as crypto from 'crypto';
 import * as path from 'path';
 import { fileURLToPath } from 'url';
 import dotenv from 'dotenv';
 import { retryWithBackoff } from './retry-utils.js';
+import {
+  STORAGE_BUCKET,
+  sha256,
+  chunkText,
+  compactEmbedding,
+  createEmbeddings,
+} from './ingest-core.js';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -30,29 +36,10 @@ if (!SUPABASE_URL || !SUPABASE_KEY || !OPENAI_KEY) {
 const supabase = createClient(SUPABASE_URL, SUPABASE_KEY);
 const openai = new OpenAI({ apiKey: OPENAI_KEY });
 
-const STORAGE_BUCKET = 'tidal-docs';
 const CHUNK_SIZE = 1500;
 const CHUNK_OVERLAP = 300;
-const EMBEDDING_MODEL = 'text-embedding-3-small';
 const BATCH_SIZE = 25;
 
-function sha256(content: string): string {
-  return crypto.createHash('sha256').update(content, 'utf-8').digest('hex');
-}
-
-function chunkText(text: string): string[] {
-  const chunks: string[] = [];
-  let start = 0;
-
-  while (start < text.length) {
-    const end = Math.min(start + CHUNK_SIZE, text.length);
-    chunks.push(text.slice(start, end));
-    start += CHUNK_SIZE - CHUNK_OVERLAP;
-  }
-
-  return chunks.length > 0 ? chunks : [text];
-}
-
 async function downloadFile(filePath: string): Promise<string> {
   return retryWithBackoff(
     async () => {
@@ -76,25 +63,6 @@ async function downloadFile(filePath: string): Promise<string> {
   );
 }
 
-async function createEmbeddings(texts: string[]): Promise<number[][]> {
-  const embeddings: number[][] = [];
-
-  for (let i = 0; i < texts.length; i += BATCH_SIZE) {
-    const batch = texts.slice(i, i + BATCH_SIZE);
-    const response = await openai.embeddings.create({
-      model: EMBEDDING_MODEL,
-      input: batch,
-    });
-    embeddings.push(...response.data.map(e => e.embedding));
-
-    if (i + BATCH_SIZE < texts.length) {
-      await new Promise(resolve => setTimeout(resolve, 1000));
-    }
-  }
-
-  return embeddings;
-}
-
 async function reingestPRD(storagePath: string) {
   console.log(`\n📥 Re-ingesting PRD: ${storagePath}\n`);
 
@@ -130,7 +98,7 @@ async function reingestPRD(storagePath: string) {
 
     // Chunk content
     console.log('✂️  Chunking content...');
-    const chunks = chunkText(content);
+    const chunks = chunkText(content, CHUNK_SIZE, CHUNK_OVERLAP);
     console.log(`✅ Created ${chunks.length} chunks\n`);
 
     if (chunks.length === 0) {
@@ -140,7 +108,7 @@ async function reingestPRD(storagePath: string) {
 
     // Create embeddings
     console.log('🧮 Creating embeddings...');
-    const embeddings = await createEmbeddings(chunks);
+    const embeddings = await createEmbeddings(openai, chunks, BATCH_SIZE, 1000);
     console.log(`✅ Created ${embeddings.length} embeddings\n`);
 
     // Find or create PRD record
@@ -212,7 +180,7 @@ async function reingestPRD(storagePath: string) {
     console.log('💾 Inserting embeddings...');
     const embeddingRows = chunkData.map((chunk, i) => ({
       chunk_id: chunk.id,
-      embedding: embeddings[i],
+      embedding: compactEmbedding(embeddings[i]),
     }));
 
     const { error: embError } = await supabase
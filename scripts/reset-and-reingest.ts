@@ -1,8 +1,10 @@
 #!/usr/bin/env tsx
 import { createClient } from '@supabase/supabase-js';
 import * as dotenv from 'dotenv';
+import * as fs from 'fs';
 import * as path from 'path';
 import { fileURLToPath } from 'url';
+import { TRACKING_FILE } from './ingest-core.js';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -14,12 +16,10 @@ const supabase = createClient(
   process.env.SUPABASE_SERVICE_ROLE_KEY!
 );
 
-async function main() {
-  console.log('\n⚠️  WARNING: This will DELETE ALL data from Supabase!\n');
-  console.log('Press Ctrl+C to cancel, or wait 5 seconds to continue...\n');
-  
-  await new Promise(resolve => setTimeout(resolve, 5000));
-  
+/**
+ * Delete table by table (fallback when reset_knowledge_base() is not installed)
+ */
+async function deleteAll() {
   console.log('🗑️  Deleting all embeddings...');
   const { error: embError } = await supabase
     .from('chunk_embeddings')
@@ -33,7 +33,7 @@ async function main() {
   const { error: chunkError } = await supabase
     .from('chunks')
     .delete()
-    .neq('document_id', '00000000-0000-0000-0000-000000000000');
+    .neq('id', '00000000-0000-0000-0000-000000000000');
   
   if (chunkError) console.error('Error:', chunkError);
   else console.log('✅ Chunks deleted');
@@ -47,6 +47,15 @@ async function main() {
   if (docError) console.error('Error:', docError);
   else console.log('✅ Documents deleted');
   
+  console.log('🗑️  Deleting all PRDs...');
+  const { error: prdError } = await supabase
+    .from('prds')
+    .delete()
+    .neq('id', '00000000-0000-0000-0000-000000000000');
+  
+  if (prdError) console.error('Error:', prdError);
+  else console.log('✅ PRDs deleted');
+  
   console.log('💾 Reclaiming database space...');
   const { error: vacuumError } = await supabase.rpc('execute_vacuum');
   
@@ -56,6 +65,35 @@ async function main() {
   } else {
     console.log('✅ Database space reclaimed');
   }
+}
+
+async function main() {
+  console.log('\n⚠️  WARNING: This will DELETE ALL data from Supabase!\n');
+  
+  // The pause is only a chance to cancel; --yes skips it for scripted resets
+  if (!process.argv.includes('--yes')) {
+    console.log('Press Ctrl+C to cancel, or wait 5 seconds to continue...\n');
+    await new Promise(resolve => setTimeout(resolve, 5000));
+  }
+  
+  // One TRUNCATE in a single round trip (see create-reset-function.sql)
+  console.log('🗑️  Clearing knowledge base...');
+  const { error: resetError } = await supabase.rpc('reset_knowledge_base');
+  
+  if (resetError?.code === 'PGRST202') {
+    // PostgREST could not find the function - it has not been installed yet
+    console.log('ℹ️  reset_knowledge_base() not available - deleting table by table');
+    console.log('   (run scripts/create-reset-function.sql in the SQL Editor to install it)');
+    await deleteAll();
+  } else if (resetError) {
+    console.error('❌ Reset failed:', resetError);
+    process.exit(1);
+  } else {
+    console.log('✅ Embeddings, chunks, documents and PRDs deleted');
+  }
+  
+  // ingest.ts trusts chunk counts in its tracker; they are stale now
+  fs.rmSync(TRACKING_FILE, { force: true });
   
   console.log('\n✅ Database cleared! Now run: npm run ingest\n');
 }
@@ -31,26 +31,112 @@ function prompt(question: string): Promise<string> {
 }
 
 /**
- * Recursively get all files in a directory
+ * Hidden files and editor temp/backup files (.foo.md.swp, foo.md~, #foo#,
+ * vim's numeric 4913 probe, .DS_Store). Uploading them would get them
+ * ingested as documents on the next full run, so neither the folder upload
+ * nor --watch sends them.
+ */
+function isTempOrHiddenFile(relativePath: string): boolean {
+  const segments = relativePath.split(/[\\/]/);
+  const baseName = segments[segments.length - 1];
+  return segments.some(segment => segment.startsWith('.')) ||
+    baseName.endsWith('~') ||
+    /^#.*#$/.test(baseName) ||
+    /^\d+$/.test(baseName) ||
+    /\.(swp|swx|swo|tmp|part|crdownload)$/i.test(baseName);
+}
+
+/**
+ * Recursively get all files in a directory, leaving out hidden and temp files
+ * Entry types come from the directory read itself, so no stat() per entry
  */
 function getAllFiles(dirPath: string, arrayOfFiles: string[] = []): string[] {
-  const files = fs.readdirSync(dirPath);
+  const entries = fs.readdirSync(dirPath, { withFileTypes: true });
 
-  files.forEach(file => {
-    const filePath = path.join(dirPath, file);
-    const stat = fs.statSync(filePath);
+  for (const entry of entries) {
+    const filePath = path.join(dirPath, entry.name);
 
-    if (stat.isDirectory()) {
-      arrayOfFiles = getAllFiles(filePath, arrayOfFiles);
-    } else {
+    // Only symlinks need a stat() to see whether they point at a directory
+    const isDirectory = entry.isDirectory() ||
+      (entry.isSymbolicLink() && fs.statSync(filePath).isDirectory());
+
+    if (isDirectory) {
+      // Hidden folders (.git, .obsidian, ...) are skipped entirely
+      if (!entry.name.startsWith('.')) {
+        getAllFiles(filePath, arrayOfFiles);
+      }
+    } else if (!isTempOrHiddenFile(entry.name)) {
       arrayOfFiles.push(filePath);
     }
-  });
+  }
 
   return arrayOfFiles;
 }
 
-async function uploadFolder(localFolder: string, remotePath: string) {
+/**
+ * Watch a local folder and upload files as they change, queueing an ingestion
+ * job for each so a running worker (npm run worker) picks it up. fs.watch is
+ * backed by inotify/FSEvents, so nothing is rescanned while the folder is idle.
+ */
+async function watchFolder(localFolder: string, remotePath: string) {
+  const { createIngestionQueue } = await import('./queue-config.js');
+  const queue = createIngestionQueue();
+  const pending = new Map<string, NodeJS.Timeout>();
+
+  const uploadChanged = async (filePath: string) => {
+    pending.delete(filePath);
+    if (!fs.existsSync(filePath) || !fs.statSync(filePath).isFile()) {
+      return;
+    }
+
+    const relativePath = path.relative(localFolder, filePath);
+    const remoteFilePath = path.join(remotePath, relativePath)
+      .replace(/\\/g, '/');
+
+    const { error } = await supabase.storage
+      .from(STORAGE_BUCKET)
+      .upload(remoteFilePath, fs.createReadStream(filePath), {
+        upsert: true,
+        duplex: 'half',
+      });
+
+    if (error) {
+      console.error(`   ❌ ${remoteFilePath}: ${error.message}`);
+      return;
+    }
+    console.log(`   ✅ ${remoteFilePath}`);
+
+    // Screenshots are only uploaded; documents get an ingestion job
+    if (!/\.(txt|md|json|pdf|ts|js|py|go|java|cpp|c|h|rb|php|rs|sh)$/i.test(remoteFilePath)) {
+      return;
+    }
+
+    let fileType: 'prd' | 'design' | 'code' = 'prd';
+    if (remoteFilePath.startsWith('designs/')) fileType = 'design';
+    else if (remoteFilePath.startsWith('code/')) fileType = 'code';
+
+    await queue.add(
+      { storagePath: remoteFilePath, type: fileType, jobIndex: 1, totalJobs: 1 },
+      { attempts: 3, backoff: { type: 'exponential', delay: 2000 } }
+    );
+    console.log(`   📤 Queued ingestion: ${path.basename(filePath)}`);
+  };
+
+  fs.watch(localFolder, { recursive: true }, (_event, fileName) => {
+    if (!fileName || isTempOrHiddenFile(fileName.toString())) return;
+    const filePath = path.join(localFolder, fileName.toString());
+
+    // Editors save in several writes - wait for the burst to settle
+    clearTimeout(pending.get(filePath));
+    pending.set(filePath, setTimeout(() => {
+      uploadChanged(filePath).catch(err => console.error(`   ❌ ${filePath}: ${err}`));
+    }, 500));
+  });
+
+  console.log(`👀 Watching ${localFolder} for changes (Ctrl+C to stop)...\n`);
+}
+
+async function uploadFolder(localFolder: string, remotePath: string): Promise<boolean> {
   // Verify local folder exists
   if (!fs.existsSync(localFolder)) {
     console.error(`❌ Local folder not found: ${localFolder}`);
@@ -64,12 +150,12 @@ async function uploadFolder(localFolder: string, remotePath: string) {
 
   try {
     // Get all files recursively
-    const allFiles = getAllFiles(localFolder);
+    const allFiles = getAllFiles(localFolder).sort();
 
     if (allFiles.length === 0) {
       console.log('📭 No files found in folder');
       rl.close();
-      return;
+      return true;
     }
 
     console.log(`✅ Found ${allFiles.length} files\n`);
@@ -95,7 +181,7 @@ async function uploadFolder(localFolder: string, remotePath: string) {
     if (confirm.toLowerCase() !== 'yes' && confirm.toLowerCase() !== 'y') {
       console.log('❌ Upload cancelled');
       rl.close();
-      return;
+      return false;
     }
 
     console.log();
@@ -114,14 +200,16 @@ async function uploadFolder(localFolder: string, remotePath: string) {
       const fileName = path.basename(filePath);
 
       try {
-        // Read file content
-        const fileContent = fs.readFileSync(filePath);
+        // Stream the file instead of reading it into memory, so large
+        // design exports don't have to fit in a single Buffer
+        const fileStream = fs.createReadStream(filePath);
 
         // Upload to Supabase
         const { error } = await supabase.storage
           .from(STORAGE_BUCKET)
-          .upload(remoteFilePath, fileContent, {
+          .upload(remoteFilePath, fileStream, {
             upsert: true, // Overwrite if exists
+            duplex: 'half', // Required by fetch for streamed request bodies
           });
 
         if (error) {
@@ -150,6 +238,7 @@ async function uploadFolder(localFolder: string, remotePath: string) {
     console.log();
 
     rl.close();
+    return true;
 
   } catch (err) {
     console.error('💥 Error:', err);
@@ -166,14 +255,18 @@ async function main() {
   console.log('📤 Supabase Folder Upload Tool');
   console.log('='.repeat(60) + '\n');
 
-  // Check for command line arguments
-  let localFolder = process.argv[2];
-  let remotePath = process.argv[3];
+  // Check for command line arguments (--watch keeps uploading changes afterwards)
+  const watch = process.argv.includes('--watch');
+  const args = process.argv.slice(2).filter(arg => arg !== '--watch');
+  let localFolder = args[0];
+  let remotePath = args[1];
 
   // If arguments provided, use them directly
   if (localFolder && remotePath) {
     console.log('Using provided arguments:\n');
-    await uploadFolder(localFolder, remotePath);
+    if (await uploadFolder(localFolder, remotePath) && watch) {
+      await watchFolder(localFolder, remotePath);
+    }
     return;
   }
 
@@ -202,7 +295,9 @@ async function main() {
   }
 
   console.log();
-  await uploadFolder(localFolder, remotePath);
+  if (await uploadFolder(localFolder, remotePath) && watch) {
+    await watchFolder(localFolder, remotePath);
+  }
 }
 
 main();